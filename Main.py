@@ -10,9 +10,13 @@ from PyQt5.QtWidgets import (
     QMessageBox, QStackedWidget, QInputDialog, QSplitter, QFrame, QProgressDialog, QListWidgetItem
 )
 from PyQt5.QtCore import Qt, pyqtSignal, QThread, QObject
-from telethon import TelegramClient, errors
+from telethon import TelegramClient, errors, events
 import discord
+import aiohttp
 from qasync import QEventLoop, asyncSlot
+from formatting import tg_to_discord, discord_to_tg
+from outbox import Outbox, DestinationUnavailable
+from entity_cache import EntityCache
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -91,6 +95,7 @@ class TelegramLoginWidget(QWidget):
         self.parent.phone_number = phone
         self.parent.api_id = api_id
         self.parent.api_hash = api_hash
+        self.parent.entity_cache.load_telegram(phone)
 
         # Очистка номера для имени файла
         safe_phone = re.sub(r'[^\d]', '', phone)  # Удаляем всё, кроме цифр
@@ -114,6 +119,7 @@ class TelegramLoginWidget(QWidget):
                 session_path, int(api_id), api_hash, system_version='5.15.2-vxCUSTOM'
             )
             await self.parent.connect_telegram()
+            self.parent.outbox.open_account('telegram', safe_phone)  # Очередь сообщений своя для каждого аккаунта
             self.save_credentials()
             progress.close()
             self.parent.on_telegram_connected(True)
@@ -213,9 +219,12 @@ class TelegramChatWidget(QWidget):
         progress.show()
         try:
             chats = []
+            peers = []
             async for dialog in self.parent.telegram_client.iter_dialogs():
                 if dialog.is_channel or dialog.is_group or dialog.is_user:
                     chats.append((dialog.name, dialog.id))
+                    peers.append((dialog.id, dialog.input_entity))
+            self.parent.entity_cache.update_tg_peers(peers)
             self.populate_tg_chats(chats)
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to load chats: {str(e)}")
@@ -245,7 +254,8 @@ class TelegramChatWidget(QWidget):
         progress.show()
         try:
             self.tg_messages_list.clear()
-            async for message in self.parent.telegram_client.iter_messages(chat_id, limit=50):
+            peer = await self.parent.entity_cache.get_tg_peer(self.parent.telegram_client, chat_id)
+            async for message in self.parent.telegram_client.iter_messages(peer, limit=50):
                 if message.message:
                     text = message.message[:50] + "..." if len(message.message) > 50 else message.message
                     item = QListWidgetItem(text)
@@ -260,10 +270,12 @@ class TelegramChatWidget(QWidget):
     @asyncSlot()
     async def select_tg_message(self, message_id):
         try:
-            async for message in self.parent.telegram_client.iter_messages(self.parent.selected_tg_chat, ids=[message_id]):
+            peer = await self.parent.entity_cache.get_tg_peer(self.parent.telegram_client, self.parent.selected_tg_chat)
+            async for message in self.parent.telegram_client.iter_messages(peer, ids=[message_id]):
                 if message.message:
-                    self.parent.selected_tg_message = message.message
-                    self.parent.discord_chat_widget.message_preview.setText(message.message)
+                    formatted = tg_to_discord(message.message, message.entities)  # Разметка Telegram -> Markdown Discord
+                    self.parent.selected_tg_message = formatted
+                    self.parent.discord_chat_widget.message_preview.setPlainText(formatted)
                     QMessageBox.information(self, "Success", "Message selected for forwarding to Discord.")
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to select message: {str(e)}")
@@ -275,17 +287,13 @@ class TelegramChatWidget(QWidget):
         if not message or not self.parent.selected_tg_chat:
             QMessageBox.warning(self, "Error", "Please select a Discord message and a Telegram chat.")
             return
-        progress = QProgressDialog("Sending message to Telegram...", None, 0, 0, self)
-        progress.setWindowModality(Qt.WindowModal)
-        progress.show()
         try:
-            await self.parent.telegram_client.send_message(self.parent.selected_tg_chat, message)
-            progress.close()
-            QMessageBox.information(self, "Success", "Message forwarded to Telegram!")
+            # Отправка идёт через очередь маршрута, поэтому недоступный Telegram не блокирует интерфейс
+            self.parent.outbox.put('telegram', self.parent.selected_tg_chat, message)
+            QMessageBox.information(self, "Success", "Message queued for forwarding to Telegram!")
         except Exception as e:
-            progress.close()
-            QMessageBox.critical(self, "Error", f"Failed to send message: {str(e)}")
-            logger.error(f"Send to Telegram error: {str(e)}", exc_info=True)
+            QMessageBox.critical(self, "Error", f"Failed to queue message: {str(e)}")
+            logger.error(f"Queue for Telegram error: {str(e)}", exc_info=True)
 
     @asyncSlot()
     async def logout_telegram(self):
@@ -307,6 +315,8 @@ class TelegramChatWidget(QWidget):
                 os.remove(session_file)
             if os.path.exists(creds_file):
                 os.remove(creds_file)
+            self.parent.entity_cache.clear_telegram()
+            self.parent.outbox.close_account('telegram', purge=True)
             self.parent.telegram_client = None
             self.parent.phone_number = ""
             self.parent.api_id = ""
@@ -473,7 +483,7 @@ class DiscordChatWidget(QWidget):
         progress.show()
         try:
             self.discord_messages_list.clear()
-            channel = self.parent.discord_client.get_channel(int(self.selected_discord_channel))
+            channel = await self.parent.entity_cache.get_discord_channel(self.parent.discord_client, self.selected_discord_channel)
             messages = []
             async for message in channel.history(limit=50):
                 if message.content:
@@ -481,7 +491,7 @@ class DiscordChatWidget(QWidget):
             self.populate_discord_messages(messages)
             # Обновляем превью для Telegram, если сообщение уже выбрано
             if self.parent.selected_tg_message:
-                self.message_preview.setText(self.parent.selected_tg_message)
+                self.message_preview.setPlainText(self.parent.selected_tg_message)
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to load messages: {str(e)}")
             logger.error(f"Load Discord messages error: {str(e)}", exc_info=True)
@@ -491,11 +501,12 @@ class DiscordChatWidget(QWidget):
     @asyncSlot()
     async def select_discord_message(self, message_id):
         try:
-            channel = self.parent.discord_client.get_channel(int(self.selected_discord_channel))
+            channel = await self.parent.entity_cache.get_discord_channel(self.parent.discord_client, self.selected_discord_channel)
             message = await channel.fetch_message(message_id)
             if message.content:
-                self.parent.selected_discord_message = message.content
-                self.parent.telegram_chat_widget.message_preview.setText(message.content)
+                # clean_content заменяет <@id> упоминания на читаемые @имя
+                self.parent.selected_discord_message = message.clean_content
+                self.parent.telegram_chat_widget.message_preview.setPlainText(message.clean_content)
                 QMessageBox.information(self, "Success", "Message selected for forwarding to Telegram.")
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to select message: {str(e)}")
@@ -507,18 +518,12 @@ class DiscordChatWidget(QWidget):
         if not message or not self.selected_discord_channel:
             QMessageBox.warning(self, "Error", "Please select a Telegram message and a Discord channel.")
             return
-        progress = QProgressDialog("Sending message to Discord...", None, 0, 0, self)
-        progress.setWindowModality(Qt.WindowModal)
-        progress.show()
         try:
-            channel = self.parent.discord_client.get_channel(int(self.selected_discord_channel))
-            await channel.send(message)
-            progress.close()
-            QMessageBox.information(self, "Success", "Message forwarded to Discord!")
+            self.parent.outbox.put('discord', int(self.selected_discord_channel), message)
+            QMessageBox.information(self, "Success", "Message queued for forwarding to Discord!")
         except Exception as e:
-            progress.close()
-            QMessageBox.critical(self, "Error", f"Failed to send message: {str(e)}")
-            logger.error(f"Send to Discord error: {str(e)}", exc_info=True)
+            QMessageBox.critical(self, "Error", f"Failed to queue message: {str(e)}")
+            logger.error(f"Queue for Discord error: {str(e)}", exc_info=True)
 
     @asyncSlot()
     async def logout_discord(self):
@@ -535,6 +540,8 @@ class DiscordChatWidget(QWidget):
         progress.show()
         try:
             await self.parent.discord_client.close()
+            self.parent.entity_cache.clear_discord()
+            self.parent.outbox.close_account('discord', purge=True)
             self.parent.discord_client = None
             self.parent.discord_token = ""
             safe_phone = re.sub(r'[^\d]', '', self.parent.phone_number) if self.parent.phone_number else ""
@@ -572,6 +579,11 @@ class MainWindow(QMainWindow):
         self.selected_discord_channel = None
         self.selected_tg_message = None
         self.selected_discord_message = None
+        self.entity_cache = EntityCache()
+        self.outbox = Outbox(
+            'sessions/spool', {'telegram': self.send_to_telegram, 'discord': self.send_to_discord},
+            on_failure=self.on_outbox_failure
+        )
         self.splitter = QSplitter(Qt.Horizontal)
         self.telegram_frame = QFrame()
         self.telegram_frame.setFrameShape(QFrame.StyledPanel)
@@ -640,6 +652,7 @@ class MainWindow(QMainWindow):
                             raise Exception("2FA password required")
                 else:
                     raise Exception("Verification code required")
+            self.telegram_client.add_event_handler(self.entity_cache.on_tg_chat_action, events.ChatAction())
             return True
         except errors.PhoneNumberInvalidError:
             raise Exception("Invalid phone number. Please use format: +1234567890")
@@ -650,7 +663,10 @@ class MainWindow(QMainWindow):
 
     async def connect_discord(self):
         try:
+            self.register_discord_cache_events()
             await self.discord_client.login(self.discord_token)
+            self.entity_cache.load_discord(self.discord_client.user.id)  # До on_ready, чтобы прогреть каналы
+            self.outbox.open_account('discord', self.discord_client.user.id)
             asyncio.create_task(self.discord_client.connect())
             return True
         except discord.LoginFailure:
@@ -658,6 +674,71 @@ class MainWindow(QMainWindow):
         except Exception as e:
             raise Exception(f"Discord connection failed: {str(e)}")
 
+    async def send_to_telegram(self, chat_id, message):
+        if not self.telegram_client or not self.telegram_client.is_connected():
+            raise DestinationUnavailable("Not connected to Telegram")
+        text, entities = discord_to_tg(message)  # Markdown Discord -> сущности Telegram
+        try:
+            for attempt in range(2):
+                peer = await self.entity_cache.get_tg_peer(self.telegram_client, chat_id)
+                try:
+                    await self.telegram_client.send_message(peer, text, formatting_entities=entities)
+                    return
+                except (errors.PeerIdInvalidError, errors.ChannelInvalidError, errors.ChannelPrivateError) as e:
+                    # Закэшированный peer устарел - получаем его заново и повторяем; вторая ошибка уходит в dead letters
+                    self.entity_cache.forget_tg_peer(chat_id)
+                    if attempt:
+                        raise
+                    logger.warning(f"Cached Telegram peer {chat_id} is stale, resolving again: {str(e)}")
+        except errors.FloodWaitError as e:
+            raise DestinationUnavailable(str(e), retry_after=e.seconds)
+        except (errors.ServerError, ConnectionError, asyncio.TimeoutError) as e:
+            raise DestinationUnavailable(str(e))
+
+    async def send_to_discord(self, channel_id, message):
+        if not self.discord_client or self.discord_client.is_closed():
+            raise DestinationUnavailable("Not connected to Discord")
+        try:
+            channel = await self.entity_cache.get_discord_channel(self.discord_client, channel_id)
+            await channel.send(message)
+        except discord.HTTPException as e:
+            if e.status == 429 or e.status >= 500:
+                raise DestinationUnavailable(str(e))
+            raise
+        except (aiohttp.ClientError, ConnectionError, asyncio.TimeoutError) as e:
+            raise DestinationUnavailable(str(e))
+
+    def on_outbox_failure(self, kind, route_id, message, error):
+        # Окно не модальное, чтобы не останавливать очередь
+        preview = message[:50] + "..." if len(message) > 50 else message
+        box = QMessageBox(QMessageBox.Warning, "Message not delivered",
+                          f"Message to {kind} {route_id} was rejected: {str(error)}\n\n{preview}\n\n"
+                          f"It was saved to the dead letters file in sessions/spool.", parent=self)
+        box.setAttribute(Qt.WA_DeleteOnClose)
+        box.setModal(False)
+        box.show()
+
+    def closeEvent(self, event):
+        self.outbox.close()  # Сообщения из памяти записываются на диск и будут отправлены при следующем запуске
+        super().closeEvent(event)
+
+    def register_discord_cache_events(self):
+        client = self.discord_client
+        cache = self.entity_cache
+
+        @client.event
+        async def on_ready():
+            await cache.warm_discord(client)
+
+        @client.event
+        async def on_guild_channel_update(before, after):
+            if after.id in cache.discord_channel_ids:
+                cache.update_discord_channel(after)
+
+        @client.event
+        async def on_guild_channel_delete(channel):
+            cache.forget_discord_channel(channel.id)
+
     def on_telegram_connected(self, success):
         if success:
             self.telegram_stacked.setCurrentIndex(1)
@@ -692,19 +773,11 @@ class MainWindow(QMainWindow):
         if not message or not self.selected_discord_channel:
             QMessageBox.warning(self, "Error", "Please select a message and a Discord channel.")
             return
-        progress = QProgressDialog("Sending message...", None, 0, 0, self)
-        progress.setWindowModality(Qt.WindowModal)
-        progress.show()
         try:
-            channel = self.discord_client.get_channel(int(self.selected_discord_channel))
-            if not channel:
-                raise Exception("Invalid channel selected")
-            await channel.send(message)
-            progress.close()
-            QMessageBox.information(self, "Success", "Message forwarded to Discord!")
+            self.outbox.put('discord', int(self.selected_discord_channel), message)
+            QMessageBox.information(self, "Success", "Message queued for forwarding to Discord!")
         except Exception as e:
-            progress.close()
-            QMessageBox.critical(self, "Error", f"Failed to send message: {str(e)}")
+            QMessageBox.critical(self, "Error", f"Failed to queue message: {str(e)}")
 
 if __name__ == '__main__':
     def handle_exception(exc_type, exc_value, exc_traceback):
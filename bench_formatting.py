@@ -0,0 +1,27 @@
+import sys
+import timeit
+from formatting import tg_to_discord, discord_to_tg
+
+# Абзац со всеми видами разметки, кириллицей и символами вне BMP (смещения UTF-16)
+PARAGRAPH = (
+    "**Жирный** текст, *курсив* и __подчёркнутый__, ~~зачёркнутый~~ и ||спойлер|| 😀\n"
+    "Ссылка: [документация](https://example.com/docs_page) и `inline_code()` в строке.\n"
+    "```python\nfor i in range(10):\n    print(i * 2)\n```\n"
+    "> цитата с **жирным** 🚀 словом\n"
+    "snake_case_name, 2 * 3 = 6 и экранированные \\*звёздочки\\*\n"
+)
+
+
+def bench(name, func, number):
+    seconds = min(timeit.repeat(func, number=number, repeat=5)) / number
+    print(f"{name:<24} {seconds * 1e6:10.1f} us/message")
+
+
+if __name__ == '__main__':
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    markdown = PARAGRAPH * repeats
+    text, entities = discord_to_tg(markdown)
+    print(f"{len(markdown)} chars of markdown, {len(entities)} entities")
+    bench("discord_to_tg", lambda: discord_to_tg(markdown), 20)
+    bench("tg_to_discord", lambda: tg_to_discord(text, entities), 20)
+    bench("plain text escape", lambda: tg_to_discord(text, None), 20)
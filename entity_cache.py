@@ -0,0 +1,166 @@
+import json
+import logging
+import os
+import re
+import discord
+from telethon.tl import types
+
+logger = logging.getLogger(__name__)
+
+# На диск пишутся только плоские peer'ы: *FromMessage ссылаются на другой peer и получаются заново
+_PEER_TYPES = {
+    'user': types.InputPeerUser,
+    'chat': types.InputPeerChat,
+    'channel': types.InputPeerChannel,
+}
+
+
+def _dump_peer(peer):
+    for kind, peer_type in _PEER_TYPES.items():
+        if type(peer) is peer_type:
+            return [kind, getattr(peer, f'{kind}_id'), getattr(peer, 'access_hash', None)]
+    return None
+
+
+def _load_peer(data):
+    kind, peer_id, access_hash = data
+    if kind == 'chat':
+        return types.InputPeerChat(int(peer_id))
+    return _PEER_TYPES[kind](int(peer_id), int(access_hash))
+
+
+class EntityCache:
+    """Resolved Telegram input peers and Discord channels for every route.
+
+    Telegram peers are persisted next to the session file so the first send
+    after a restart doesn't need a resolve call against the flood limits.
+    Only ``InputPeerUser``/``Chat``/``Channel`` are written; other peers are
+    resolved again after a restart. Discord channel IDs are persisted per
+    Discord account.
+    """
+
+    def __init__(self):
+        self.tg_peers = {}
+        self.discord_channel_ids = set()
+        self.discord_channels = {}
+        self.tg_path = None
+        self.discord_path = None
+
+    def load_telegram(self, phone):
+        safe_phone = re.sub(r'[^\d]', '', phone)
+        self.tg_path = f'sessions/{safe_phone}_peers.json'
+        self.tg_peers.clear()
+        if not os.path.exists(self.tg_path):
+            return
+        try:
+            with open(self.tg_path, 'r') as f:
+                data = json.load(f)
+            for chat_id, peer in data.items():
+                try:
+                    self.tg_peers[int(chat_id)] = _load_peer(peer)
+                except (ValueError, TypeError, KeyError) as e:
+                    logger.warning(f"Skipping cached Telegram peer {chat_id}: {str(e)}")
+            logger.info(f"Loaded {len(self.tg_peers)} cached Telegram peers")
+        except (OSError, ValueError, AttributeError) as e:
+            logger.error(f"Failed to load Telegram peer cache: {str(e)}")
+
+    def load_discord(self, user_id):
+        self.discord_path = f'sessions/discord_{user_id}_channels.json'
+        self.discord_channel_ids.clear()
+        self.discord_channels.clear()
+        if not os.path.exists(self.discord_path):
+            return
+        try:
+            with open(self.discord_path, 'r') as f:
+                self.discord_channel_ids.update(int(channel_id) for channel_id in json.load(f))
+        except (OSError, ValueError, TypeError) as e:
+            logger.error(f"Failed to load Discord channel cache: {str(e)}")
+
+    def _write(self, path, data):
+        if not path:
+            return
+        try:
+            os.makedirs('sessions', exist_ok=True)
+            with open(path, 'w') as f:
+                json.dump(data, f)
+        except OSError as e:
+            logger.error(f"Failed to save entity cache: {str(e)}")
+
+    def save_telegram(self):
+        peers = {str(chat_id): _dump_peer(peer) for chat_id, peer in self.tg_peers.items()}
+        self._write(self.tg_path, {chat_id: peer for chat_id, peer in peers.items() if peer})
+
+    def save_discord(self):
+        self._write(self.discord_path, sorted(self.discord_channel_ids))
+
+    def clear_telegram(self):
+        self.tg_peers.clear()
+        if self.tg_path and os.path.exists(self.tg_path):
+            os.remove(self.tg_path)
+        self.tg_path = None
+
+    def clear_discord(self):
+        self.discord_channel_ids.clear()
+        self.discord_channels.clear()
+        if self.discord_path and os.path.exists(self.discord_path):
+            os.remove(self.discord_path)
+        self.discord_path = None
+
+    def update_tg_peers(self, peers):
+        changed = False
+        for chat_id, peer in peers:
+            if self.tg_peers.get(chat_id) != peer:
+                self.tg_peers[chat_id] = peer
+                changed = True
+        if changed:
+            self.save_telegram()
+
+    def forget_tg_peer(self, chat_id):
+        if self.tg_peers.pop(chat_id, None) is not None:
+            self.save_telegram()
+
+    async def get_tg_peer(self, client, chat_id):
+        peer = self.tg_peers.get(chat_id)
+        if peer is None:
+            peer = await client.get_input_entity(chat_id)
+            self.update_tg_peers([(chat_id, peer)])
+        return peer
+
+    async def on_tg_chat_action(self, event):
+        # Участники/название/доступ изменились - обновляем peer, если чат уже в кэше
+        if event.chat_id in self.tg_peers:
+            try:
+                self.update_tg_peers([(event.chat_id, await event.get_input_chat())])
+            except Exception as e:
+                logger.error(f"Failed to refresh Telegram peer {event.chat_id}: {str(e)}")
+                self.forget_tg_peer(event.chat_id)
+
+    async def warm_discord(self, client):
+        for channel_id in list(self.discord_channel_ids):
+            try:
+                await self.get_discord_channel(client, channel_id)
+            except discord.NotFound:
+                self.forget_discord_channel(channel_id)
+            except Exception as e:
+                logger.error(f"Failed to warm Discord channel {channel_id}: {str(e)}")
+        logger.info(f"Warmed {len(self.discord_channels)} Discord channels")
+
+    def update_discord_channel(self, channel):
+        self.discord_channels[channel.id] = channel
+        if channel.id not in self.discord_channel_ids:
+            self.discord_channel_ids.add(channel.id)
+            self.save_discord()
+
+    def forget_discord_channel(self, channel_id):
+        self.discord_channels.pop(channel_id, None)
+        if channel_id in self.discord_channel_ids:
+            self.discord_channel_ids.discard(channel_id)
+            self.save_discord()
+
+    async def get_discord_channel(self, client, channel_id):
+        channel_id = int(channel_id)
+        channel = self.discord_channels.get(channel_id)
+        if channel is None:
+            channel = client.get_channel(channel_id) or await client.fetch_channel(channel_id)
+            self.update_discord_channel(channel)
+        return channel
@@ -0,0 +1,493 @@
+import re
+from telethon.tl import types
+
+# Telegram -> Discord
+
+# Классы символов без вложенных квантификаторов: поиск линейный, откатов нет
+_ESCAPE = re.compile(r'[\\*_~|`\[\]]')
+_LINE_START = re.compile(r'^([ \t]*)(>|(?:#{1,3}|-#|[-+]|\d+\.)(?=[ \t]))', re.M)
+_ASTRAL = re.compile('[\U00010000-\U0010ffff]')
+_TICKS = re.compile('`+')
+
+# Разделитель между закрывающими и открывающими маркерами из одного символа ("*" + "**")
+_SEPARATOR = '\u200b'
+_MARKER_CHARS = '*_~|`'
+
+_MARKERS = {
+    types.MessageEntityBold: ('**', '**'),
+    types.MessageEntityItalic: ('*', '*'),
+    types.MessageEntityUnderline: ('__', '__'),
+    types.MessageEntityStrike: ('~~', '~~'),
+    types.MessageEntitySpoiler: ('||', '||'),
+    types.MessageEntityBlockquote: ('> ', ''),
+}
+
+# Текст внутри этих сущностей отправляется как есть, без экранирования
+_RAW = (
+    types.MessageEntityCode, types.MessageEntityPre, types.MessageEntityUrl,
+    types.MessageEntityEmail, types.MessageEntityMention
+)
+
+# Discord не распознаёт разметку с пробелом у маркера ("**ends **"), поэтому пробелы выносятся наружу
+_TRIMMED = (
+    types.MessageEntityBold, types.MessageEntityItalic, types.MessageEntityUnderline,
+    types.MessageEntityStrike, types.MessageEntitySpoiler, types.MessageEntityTextUrl
+)
+
+
+def _fence(text, start, end, minimum):
+    # Ограждение длиннее самой длинной серии ` внутри кода, иначе код обрывается на ней
+    longest = max((len(match.group()) for match in _TICKS.finditer(text, start, end)), default=0)
+    return '`' * max(minimum, longest + 1)
+
+
+def _markers(entity, text='', start=0, end=0):
+    markers = _MARKERS.get(type(entity))
+    if markers:
+        return markers
+    if isinstance(entity, types.MessageEntityCode):
+        fence = _fence(text, start, end, 1)
+        first, last = text[start], text[end - 1]
+        # Пробелы по краям отделяют ограждение от ` в коде; при разборе снимается по одному
+        if len(fence) >= 3 or '`' in (first, last) or (first == last == ' ' and text[start:end].strip(' ')):
+            return fence + ' ', ' ' + fence
+        return fence, fence
+    if isinstance(entity, types.MessageEntityPre):
+        fence = _fence(text, start, end, 3)
+        return fence + (entity.language or '') + '\n', '\n' + fence
+    if isinstance(entity, types.MessageEntityTextUrl):
+        # В <...> адрес со скобками не обрывается на первой ")"
+        return '[', '](<' + entity.url.replace(' ', '%20').replace('>', '%3E') + '>)'
+    return '', ''
+
+
+def _escape_line_start(match):
+    indent, mark = match.groups()
+    if mark[0].isdigit():
+        return indent + mark[:-1] + '\\.'
+    return indent + '\\' + mark
+
+
+def _escape(text, line_start=True):
+    text = _ESCAPE.sub(lambda match: '\\' + match.group(), text)
+    if line_start:
+        return _LINE_START.sub(_escape_line_start, text)
+    # Первая строка фрагмента продолжает уже начатую строку
+    head, newline, rest = text.partition('\n')
+    if not newline:
+        return text
+    return head + newline + _LINE_START.sub(_escape_line_start, rest)
+
+
+def _utf16_indices(text, offsets):
+    # Telegram считает смещения в UTF-16; символы вне BMP занимают две единицы вместо одной
+    astral = [] if text.isascii() else [match.start() for match in _ASTRAL.finditer(text)]
+    indices = {}
+    skipped = 0
+    for offset in sorted(set(offsets)):
+        while skipped < len(astral) and astral[skipped] + skipped < offset:
+            skipped += 1
+        indices[offset] = min(offset - skipped, len(text))
+    return indices
+
+
+def _merge(spans):
+    # Одинаковые сущности не вкладываются друг в друга: пересечения объединяются,
+    # а ссылки с разными адресами (или блоки с разным языком) обрезаются
+    spans.sort(key=lambda span: (type(span[2]).__name__, span[0], -span[1]))
+    merged = []
+    for span in spans:
+        last = merged[-1] if merged else None
+        if last and type(last[2]) is type(span[2]) and span[0] <= last[1]:
+            if getattr(last[2], 'url', None) == getattr(span[2], 'url', None) \
+                    and getattr(last[2], 'language', None) == getattr(span[2], 'language', None):
+                last[1] = max(last[1], span[1])
+                continue
+            span[0] = last[1]
+            if span[0] >= span[1]:
+                continue
+        merged.append(span)
+    return merged
+
+
+def _trim(text, item, end):
+    span, start, inner_start, inner_end = item
+    entity = span[2]
+    if isinstance(entity, _TRIMMED):
+        limit = min(inner_start, end)
+        while start < limit and text[start].isspace():
+            start += 1
+    if isinstance(entity, _TRIMMED) or isinstance(entity, types.MessageEntityBlockquote):
+        limit = max(inner_end, start)
+        while end > limit and text[end - 1].isspace():
+            end -= 1
+    return (start, end) if start < end else None
+
+
+def _nest(text, spans):
+    # Пересекающиеся сущности режутся в точках пересечения на правильно вложенные части.
+    # После _merge на каждый тип приходится не больше одной открытой сущности,
+    # поэтому глубина стека ограничена и проход остаётся линейным
+    spans.sort(key=lambda span: (span[0], -span[1]))
+    boundaries = sorted({index for span in spans for index in span[:2]})
+    stack = []  # [span, начало части, границы вложенных частей]
+    pieces = []
+    next_span = 0
+    for pos in boundaries:
+        ending = sum(1 for item in stack if item[0][1] == pos)
+        reopen = []
+        while ending:
+            item = stack.pop()
+            piece = _trim(text, item, pos)
+            if piece:
+                pieces.append(piece + (len(stack), item[0][2]))
+                if stack:
+                    stack[-1][2] = min(stack[-1][2], piece[0])
+                    stack[-1][3] = max(stack[-1][3], piece[1])
+            if item[0][1] == pos:
+                ending -= 1
+            else:
+                reopen.append(item[0])
+        for span in reversed(reopen):
+            stack.append([span, pos, len(text), -1])
+        while next_span < len(spans) and spans[next_span][0] == pos:
+            stack.append([spans[next_span], pos, len(text), -1])
+            next_span += 1
+    return pieces
+
+
+def tg_to_discord(text, entities):
+    """Render Telegram text with its message entities as Discord markdown."""
+    if not text:
+        return ''
+    if not entities:
+        return _escape(text)
+    indices = _utf16_indices(text, [o for e in entities for o in (e.offset, e.offset + e.length)])
+    spans = [
+        [indices[e.offset], indices[e.offset + e.length], e] for e in entities
+        if e.length > 0 and (isinstance(e, _RAW) or any(_markers(e)))
+    ]
+    # (start, end, depth, entity), внешние части раньше внутренних
+    pieces = sorted(_nest(text, _merge(spans)), key=lambda piece: (piece[0], -piece[1], piece[2]))
+    boundaries = sorted({index for piece in pieces for index in piece[:2]})
+
+    out = []
+    stack = []
+    depth = {'raw': 0, 'quote': 0}
+
+    def emit(segment, start):
+        if not segment:
+            return
+        if not depth['raw']:
+            segment = _escape(segment, start == 0 or text[start - 1] == '\n')
+        if depth['quote']:
+            segment = segment.replace('\n', '\n> ')
+        out.append(segment)
+
+    def marker(value):
+        if depth['quote'] and '\n' in value:
+            value = value.replace('\n', '\n> ')
+        return value
+
+    prev = 0
+    next_piece = 0
+    for pos in boundaries:
+        emit(text[prev:pos], prev)
+        prev = pos
+        closing = ''
+        while stack and stack[-1][0][1] == pos:
+            piece, close = stack.pop()
+            if close is not None:
+                closing += marker(close)
+            depth['raw'] -= isinstance(piece[3], _RAW)
+            depth['quote'] -= isinstance(piece[3], types.MessageEntityBlockquote)
+        opening = ''
+        while next_piece < len(pieces) and pieces[next_piece][0] == pos:
+            piece = pieces[next_piece]
+            next_piece += 1
+            # Разметка внутри кода не работает, поэтому вложенные сущности не выводим
+            close = None
+            if not depth['raw']:
+                open_marker, close = _markers(piece[3], text, piece[0], piece[1])
+                opening += marker(open_marker)
+            depth['raw'] += isinstance(piece[3], _RAW)
+            depth['quote'] += isinstance(piece[3], types.MessageEntityBlockquote)
+            stack.append((piece, close))
+        out.append(closing)
+        if closing and opening and closing[-1] == opening[0] and closing[-1] in _MARKER_CHARS:
+            out.append(_SEPARATOR)
+        out.append(opening)
+    emit(text[prev:], prev)
+    return ''.join(out)
+
+
+# Discord -> Telegram
+
+_SPECIAL = re.compile(r'[\\`*_~|\[\]>\n]')
+_LINK_SCAN = re.compile(r'\]\(|[()>\s]')
+
+_ENTITY_TYPES = {
+    '**': types.MessageEntityBold,
+    '*': types.MessageEntityItalic,
+    '_': types.MessageEntityItalic,
+    '__': types.MessageEntityUnderline,
+    '~~': types.MessageEntityStrike,
+    '||': types.MessageEntitySpoiler,
+}
+
+_PUNCTUATION = frozenset('!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~')
+
+TEXT, DELIM, CODE, PRE, QUOTE_OPEN, QUOTE_CLOSE, LINK_OPEN, LINK_CLOSE = range(8)
+
+
+def _utf16_len(text):
+    if text.isascii() or max(text) <= '\uffff':
+        return len(text)
+    return len(text.encode('utf-16-le')) // 2
+
+
+def _split_run(char, run):
+    if char in '*_':
+        return [char * 2, char] if run >= 3 else [char * run]
+    return [char * 2] if run >= 2 else []
+
+
+def _link_targets(text):
+    # Адрес в <...> или со сбалансированными скобками: https://en.wikipedia.org/wiki/Python_(language).
+    # Все "](" разбираются за один проход: отдельный поиск от каждой ссылки делает "[a](" * n квадратичным
+    targets = {}  # начало адреса -> (начало, конец, позиция закрывающей ")")
+    pending = []  # (начало адреса, глубина скобок)
+    angled = []
+    depth = 0
+    for match in _LINK_SCAN.finditer(text):
+        char = match.group()
+        index = match.start()
+        if char == '](':
+            depth += 1
+            start = match.end()
+            if text.startswith('<', start):
+                angled.append(start)
+            else:
+                pending.append((start, depth))
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            while pending and pending[-1][1] > depth:
+                start = pending.pop()[0]
+                targets[start] = (start, index, index)
+        elif char == '>':
+            if text.startswith(')', index + 1):
+                for start in angled:
+                    targets[start] = (start + 1, index, index + 1)
+            angled.clear()
+        else:
+            # Адрес с пробелом ссылкой не считается
+            pending.clear()
+            angled.clear()
+    return targets
+
+
+def _tokenize(text):
+    tokens = []
+    opened = {}
+    missing = set()  # закрывающие последовательности, которых дальше в тексте нет
+    bracket = -1
+    targets = None
+    links = {}
+    link_close = -1
+    link_end = -1
+    quote = None  # 'line' для строк "> ", 'all' для ">>> " до конца сообщения
+    pos = 0
+    length = len(text)
+
+    def find(needle, start):
+        if needle in missing:
+            return -1
+        index = text.find(needle, start)
+        if index == -1:
+            missing.add(needle)
+        return index
+
+    def find_fence(run, start):
+        # Закрывает серия ` той же длины, более длинные серии пропускаются
+        while True:
+            index = find('`' * run, start)
+            if index == -1:
+                return -1
+            start = index + run
+            while start < length and text[start] == '`':
+                start += 1
+            if start - index == run:
+                return index
+
+    while True:
+        match = _SPECIAL.search(text, pos)
+        if match is None:
+            break
+        i = match.start()
+        if i > pos:
+            tokens.append([TEXT, text[pos:i]])
+        char = text[i]
+        pos = i + 1
+
+        if char == '\\':
+            if i + 1 < length and text[i + 1] in _PUNCTUATION:
+                tokens.append([TEXT, text[i + 1]])
+                pos = i + 2
+            else:
+                tokens.append([TEXT, char])
+        elif char == '`':
+            run = 1
+            while i + run < length and text[i + run] == '`':
+                run += 1
+            end = find_fence(run, i + run)
+            if end == -1:
+                tokens.append([TEXT, '`' * run])
+                pos = i + run
+                continue
+            content = text[i + run:end]
+            pos = end + run
+            padded = content[:1] == content[-1:] == ' ' and content.strip(' ')
+            if run >= 3 and not (padded and '\n' not in content):
+                if quote == 'line':
+                    content = content.replace('\n> ', '\n')
+                language = ''
+                first, newline, rest = content.partition('\n')
+                if newline and (not first or ' ' not in first):
+                    language, content = first, rest
+                if content.endswith('\n'):
+                    content = content[:-1]
+                tokens.append([PRE, content, language])
+            else:
+                tokens.append([CODE, content[1:-1] if padded else content])
+        elif char in '*_~|':
+            run = 1
+            while i + run < length and text[i + run] == char:
+                run += 1
+            pos = i + run
+            before = text[i - 1] if i else ' '
+            after = text[pos] if pos < length else ' '
+            delimiters = _split_run(char, run)
+            literal = run - sum(len(d) for d in delimiters)
+            if literal:
+                tokens.append([TEXT, char * literal])
+            for delimiter in delimiters:
+                opener = opened.get(delimiter)
+                if opener is not None and not before.isspace() and not (delimiter == '_' and after.isalnum()):
+                    tokens[opener][2] = len(tokens)
+                    tokens.append([DELIM, delimiter, opener])
+                    del opened[delimiter]
+                elif opener is None and not after.isspace() and not (delimiter == '_' and before.isalnum()):
+                    opened[delimiter] = len(tokens)
+                    tokens.append([DELIM, delimiter, None])
+                else:
+                    tokens.append([TEXT, delimiter])
+        elif char == '[':
+            if link_close > i:
+                tokens.append([TEXT, char])
+                continue
+            if bracket < i:
+                bracket = find(']', i + 1)
+            if bracket != -1 and bracket not in links:
+                links[bracket] = None
+                if text.startswith('(', bracket + 1):
+                    if targets is None:
+                        targets = _link_targets(text)
+                    target = targets.get(bracket + 2)
+                    if target and text.startswith(('http://', 'https://'), target[0], target[1]):
+                        links[bracket] = (text[target[0]:target[1]], target[2])
+            if bracket != -1 and links[bracket]:
+                link_close = bracket
+                link_end = links[bracket][1]
+                tokens.append([LINK_OPEN])
+            else:
+                tokens.append([TEXT, char])
+        elif char == ']':
+            if i == link_close:
+                tokens.append([LINK_CLOSE, links[i][0]])
+                pos = link_end + 1
+            else:
+                tokens.append([TEXT, char])
+        elif char == '>':
+            line_start = quote is None and (i == 0 or text[i - 1] == '\n')
+            if line_start and text.startswith('> ', i):
+                tokens.append([QUOTE_OPEN])
+                quote = 'line'
+                pos = i + 2
+            elif line_start and text.startswith('>>> ', i):
+                tokens.append([QUOTE_OPEN])
+                quote = 'all'
+                pos = i + 4
+            else:
+                tokens.append([TEXT, char])
+        elif char == '\n':
+            if quote == 'line':
+                # Подряд идущие строки "> " объединяются в одну цитату
+                if text.startswith('> ', i + 1):
+                    tokens.append([TEXT, char])
+                    pos = i + 3
+                    continue
+                tokens.append([QUOTE_CLOSE])
+                quote = None
+            tokens.append([TEXT, char])
+    if pos < length:
+        tokens.append([TEXT, text[pos:]])
+    if quote is not None:
+        tokens.append([QUOTE_CLOSE])
+    return tokens
+
+
+def discord_to_tg(text):
+    """Parse Discord markdown into plain text and Telegram message entities."""
+    if not text:
+        return '', []
+    out = []
+    entities = []
+    offsets = {}
+    links = []
+    quote = 0
+    pos = 0
+    tokens = _tokenize(text)
+    for index, token in enumerate(tokens):
+        kind = token[0]
+        if kind == TEXT and token[1] == _SEPARATOR and 0 < index < len(tokens) - 1 \
+                and tokens[index - 1][0] != TEXT and tokens[index + 1][0] != TEXT:
+            continue
+        if kind == TEXT:
+            out.append(token[1])
+            pos += _utf16_len(token[1])
+        elif kind == DELIM:
+            partner = token[2]
+            if partner is None:
+                out.append(token[1])
+                pos += len(token[1])
+            elif partner > index:
+                offsets[index] = pos
+            else:
+                start = offsets.pop(partner)
+                if pos > start:
+                    entities.append(_ENTITY_TYPES[token[1]](start, pos - start))
+        elif kind in (CODE, PRE):
+            content = token[1]
+            size = _utf16_len(content)
+            if size:
+                if kind == CODE:
+                    entities.append(types.MessageEntityCode(pos, size))
+                else:
+                    entities.append(types.MessageEntityPre(pos, size, token[2]))
+            out.append(content)
+            pos += size
+        elif kind == LINK_OPEN:
+            links.append(pos)
+        elif kind == LINK_CLOSE:
+            start = links.pop()
+            if pos > start:
+                entities.append(types.MessageEntityTextUrl(start, pos - start, token[1]))
+        elif kind == QUOTE_OPEN:
+            quote = pos
+        elif kind == QUOTE_CLOSE:
+            if pos > quote:
+                entities.append(types.MessageEntityBlockquote(quote, pos - quote))
+    entities.sort(key=lambda entity: entity.offset)
+    return ''.join(out), entities
@@ -0,0 +1,286 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+MAX_MEMORY_MESSAGES = 100  # Сообщений в памяти на один маршрут, остальное уходит на диск
+SEGMENT_MESSAGES = 500
+MAX_RETRY_DELAY = 60
+
+
+class DestinationUnavailable(Exception):
+    """Raised by a sender when the message should be retried later."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RouteOutbox:
+    """Ordered outbox for a single destination.
+
+    Up to ``max_memory`` messages are kept in memory; overflow is appended to
+    numbered segment files in ``spool_dir`` and drained in order once the
+    destination is reachable again. As soon as a send is deferred (and on
+    ``close``) the in-memory messages are written to the head of the spool,
+    so nothing queued during an outage is lost on restart. Messages the
+    destination rejects go to ``dead_letters.jsonl`` and ``on_failure``.
+    Every route has its own worker, so an outage on one destination doesn't
+    hold up the others.
+    """
+
+    def __init__(self, name, send, spool_dir, on_failure=None,
+                 max_memory=MAX_MEMORY_MESSAGES, segment_size=SEGMENT_MESSAGES):
+        self.name = name
+        self.send = send
+        self.spool_dir = spool_dir
+        self.on_failure = on_failure
+        self.max_memory = max_memory
+        self.segment_size = segment_size
+        self.memory = deque()
+        os.makedirs(spool_dir, exist_ok=True)
+        self.segments = deque(sorted(
+            (f for f in os.listdir(spool_dir) if f.endswith('.log')), key=lambda f: int(f[:-4])
+        ))
+        self.next_segment = int(self.segments[-1][:-4]) + 1 if self.segments else 0
+        self.cursor_path = os.path.join(spool_dir, 'cursor.json')
+        self.dead_letters_path = os.path.join(spool_dir, 'dead_letters.jsonl')
+        self.writer = None
+        self.written = 0
+        self.reader = None
+        self.wakeup = asyncio.Event()
+        self.task = None
+        if self.segments:
+            logger.info(f"{self.name}: resuming {len(self.segments)} spooled segment(s)")
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        try:
+            self.flush_memory()
+        except OSError as e:
+            logger.error(f"{self.name}: failed to spool queued messages: {str(e)}")
+        for handle in (self.reader, self.writer):
+            if handle is not None:
+                handle.close()
+        self.reader = self.writer = None
+
+    def put(self, message):
+        # Пока на диске есть сообщения, новые пишутся туда же, чтобы сохранить порядок
+        if not self.segments and len(self.memory) < self.max_memory:
+            self.memory.append(message)
+        else:
+            self._spill(message)
+        self.wakeup.set()
+
+    def _segment_path(self, name):
+        return os.path.join(self.spool_dir, name)
+
+    def _spill(self, message):
+        if self.writer is None or self.written >= self.segment_size:
+            if self.writer is not None:
+                self.writer.close()
+            name = f'{self.next_segment:010d}.log'
+            self.next_segment += 1
+            self.segments.append(name)
+            self.writer = open(self._segment_path(name), 'a', encoding='utf-8')
+            self.written = 0
+            logger.warning(f"{self.name}: spilling to {name}")
+        self.writer.write(json.dumps(message) + '\n')
+        self.writer.flush()
+        self.written += 1
+
+    def flush_memory(self):
+        # Сообщения в памяти старше всего, что лежит на диске, поэтому пишутся в сегмент перед первым
+        if not self.memory:
+            return
+        number = int(self.segments[0][:-4]) - 1 if self.segments else self.next_segment
+        if not self.segments:
+            self.next_segment += 1
+        name = f'{number:010d}.log'
+        with open(self._segment_path(name), 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(message) + '\n' for message in self.memory)
+            f.flush()
+            os.fsync(f.fileno())
+        self.segments.appendleft(name)
+        logger.warning(f"{self.name}: wrote {len(self.memory)} queued message(s) to {name}")
+        self.memory.clear()
+
+    def _open_reader(self):
+        self.reader = open(self._segment_path(self.segments[0]), 'r', encoding='utf-8')
+        try:
+            with open(self.cursor_path, 'r') as f:
+                cursor = json.load(f)
+            if cursor.get('segment') == self.segments[0]:
+                self.reader.seek(cursor['offset'])
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _save_cursor(self):
+        try:
+            with open(self.cursor_path, 'w') as f:
+                json.dump({'segment': self.segments[0], 'offset': self.reader.tell()}, f)
+        except OSError as e:
+            logger.error(f"{self.name}: failed to save spool cursor: {str(e)}")
+
+    def _drop_segment(self):
+        name = self.segments.popleft()
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+        if self.writer is not None and not self.segments:
+            self.writer.close()
+            self.writer = None
+        for path in (self._segment_path(name), self.cursor_path):
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except OSError as e:
+                logger.error(f"{self.name}: failed to remove {path}: {str(e)}")
+
+    def _peek(self):
+        if self.memory:
+            return self.memory[0]
+        while self.segments:
+            if self.reader is None:
+                try:
+                    self._open_reader()
+                except OSError as e:
+                    logger.error(f"{self.name}: cannot open {self.segments[0]}, skipping it: {str(e)}")
+                    self._drop_segment()
+                    continue
+            offset = self.reader.tell()
+            line = self.reader.readline()
+            if not line.endswith('\n'):
+                # Конец сегмента (или недописанная строка после сбоя)
+                self._drop_segment()
+                continue
+            try:
+                message = json.loads(line)
+            except ValueError:
+                logger.error(f"{self.name}: skipping corrupt line in {self.segments[0]}")
+                self._save_cursor()
+                continue
+            self.reader.seek(offset)  # Сдвигаемся только после успешной отправки
+            return message
+        return None
+
+    def _ack(self):
+        if self.memory:
+            self.memory.popleft()
+        else:
+            self.reader.readline()
+            self._save_cursor()
+
+    def _dead_letter(self, message, error):
+        logger.error(f"{self.name}: message rejected, saved to {self.dead_letters_path}: {str(error)}")
+        try:
+            with open(self.dead_letters_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'time': time.time(), 'error': str(error), 'message': message}) + '\n')
+        except OSError as e:
+            logger.error(f"{self.name}: failed to write dead letter: {str(e)}")
+        if self.on_failure:
+            self.on_failure(message, error)
+
+    async def run(self):
+        delay = 1
+        while True:
+            try:
+                message = self._peek()
+            except OSError as e:
+                logger.error(f"{self.name}: spool read failed, retrying in {delay}s: {str(e)}")
+                await asyncio.sleep(delay)
+                continue
+            if message is None:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            try:
+                await self.send(message)
+            except DestinationUnavailable as e:
+                wait = e.retry_after or delay
+                logger.warning(f"{self.name}: destination unavailable, retrying in {wait}s: {str(e)}")
+                try:
+                    self.flush_memory()
+                except OSError as flush_error:
+                    logger.error(f"{self.name}: failed to spool queued messages: {str(flush_error)}")
+                await asyncio.sleep(wait)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+                continue
+            except Exception as e:
+                self._dead_letter(message, e)
+            self._ack()
+            delay = 1
+
+
+class Outbox:
+    """Per-route outboxes keyed by ``(kind, route_id)``, e.g. ``('discord', channel_id)``.
+
+    Spools are scoped to the logged in account of each kind, so queued
+    messages are never replayed through another account.
+    """
+
+    def __init__(self, spool_root, senders, on_failure=None):
+        self.spool_root = spool_root
+        self.senders = senders
+        self.on_failure = on_failure
+        self.accounts = {}
+        self.routes = {}
+
+    def open_account(self, kind, account):
+        if self.accounts.get(kind) == account:
+            return
+        self.close_account(kind)
+        self.accounts[kind] = account
+        # Досылаем то, что осталось на диске с прошлого запуска
+        account_dir = self._account_dir(kind)
+        if os.path.isdir(account_dir):
+            for name in os.listdir(account_dir):
+                if name.lstrip('-').isdigit():
+                    self.route(kind, int(name))
+
+    def close_account(self, kind, purge=False):
+        for key in [key for key in self.routes if key[0] == kind]:
+            self.routes.pop(key).close()
+        if kind in self.accounts:
+            account_dir = self._account_dir(kind)
+            del self.accounts[kind]
+            if purge:
+                shutil.rmtree(account_dir, ignore_errors=True)
+
+    def close(self):
+        for kind in list(self.accounts):
+            self.close_account(kind)
+
+    def _account_dir(self, kind):
+        return os.path.join(self.spool_root, f'{kind}_{self.accounts[kind]}')
+
+    def route(self, kind, route_id):
+        key = (kind, route_id)
+        if key not in self.routes:
+            if kind not in self.accounts:
+                raise RuntimeError(f"Not logged in to {kind}")
+            send = self.senders[kind]
+            on_failure = None
+            if self.on_failure:
+                on_failure = lambda message, error: self.on_failure(kind, route_id, message, error)
+            route = RouteOutbox(
+                f'{kind}:{route_id}', lambda message: send(route_id, message),
+                os.path.join(self._account_dir(kind), str(route_id)), on_failure
+            )
+            route.start()
+            self.routes[key] = route
+        return self.routes[key]
+
+    def put(self, kind, route_id, message):
+        self.route(kind, route_id).put(message)
@@ -0,0 +1,119 @@
+import asyncio
+import json
+from telethon.tl import types
+from entity_cache import EntityCache
+
+PHONE = '+1234567890'
+PEERS = {
+    1: types.InputPeerUser(1, 111),
+    -2: types.InputPeerChat(2),
+    -1003: types.InputPeerChannel(3, 333),
+}
+
+
+class FakeTelegramClient:
+    def __init__(self):
+        self.resolved = []
+
+    async def get_input_entity(self, chat_id):
+        self.resolved.append(chat_id)
+        return types.InputPeerUser(chat_id, 999)
+
+
+class FakeChannel:
+    def __init__(self, channel_id):
+        self.id = channel_id
+
+
+def test_peers_survive_reload(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache = EntityCache()
+    cache.load_telegram(PHONE)
+    cache.update_tg_peers(PEERS.items())
+
+    reloaded = EntityCache()
+    reloaded.load_telegram(PHONE)
+    assert reloaded.tg_peers == PEERS
+
+    client = FakeTelegramClient()
+    assert asyncio.run(reloaded.get_tg_peer(client, 1)) == PEERS[1]
+    assert asyncio.run(reloaded.get_tg_peer(client, 4)) == types.InputPeerUser(4, 999)
+    assert client.resolved == [4]
+
+    reloaded.forget_tg_peer(1)
+    cache.load_telegram(PHONE)
+    assert set(cache.tg_peers) == {-2, -1003, 4}
+
+
+def test_nested_peers_are_not_persisted(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    nested = types.InputPeerUserFromMessage(types.InputPeerChannel(3, 333), 10, 5)
+    cache = EntityCache()
+    cache.load_telegram(PHONE)
+    cache.update_tg_peers([(5, nested), (1, PEERS[1])])
+    assert cache.tg_peers[5] == nested
+
+    reloaded = EntityCache()
+    reloaded.load_telegram(PHONE)
+    assert reloaded.tg_peers == {1: PEERS[1]}
+
+
+def test_corrupt_peer_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'sessions').mkdir()
+    path = tmp_path / 'sessions' / '1234567890_peers.json'
+    cache = EntityCache()
+
+    path.write_text('{not json')
+    cache.load_telegram(PHONE)
+    assert cache.tg_peers == {}
+
+    path.write_text('[1, 2]')
+    cache.load_telegram(PHONE)
+    assert cache.tg_peers == {}
+
+    # Записи без типа, в старом формате to_dict() и с неизвестным типом пропускаются по одной
+    path.write_text(json.dumps({
+        '1': ['user', 1, 111],
+        '2': {'user_id': 2, 'access_hash': 222},
+        '3': {'_': 'InputPeerUser', 'user_id': 3, 'access_hash': 333},
+        '4': ['bot', 4, 444],
+        '5': ['user', 5, None],
+        'x': ['chat', 6, None],
+    }))
+    cache.load_telegram(PHONE)
+    assert cache.tg_peers == {1: PEERS[1]}
+
+
+def test_discord_channels_are_per_account(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache = EntityCache()
+    cache.load_telegram(PHONE)
+    cache.update_tg_peers([(1, PEERS[1])])
+
+    cache.load_discord(100)
+    cache.update_discord_channel(FakeChannel(10))
+    cache.update_discord_channel(FakeChannel(11))
+    cache.load_discord(200)
+    assert cache.discord_channel_ids == set()
+    assert cache.discord_channels == {}
+    cache.update_discord_channel(FakeChannel(20))
+
+    cache.load_discord(100)
+    assert cache.discord_channel_ids == {10, 11}
+    assert (tmp_path / 'sessions' / 'discord_200_channels.json').exists()
+
+    cache.clear_discord()
+    assert not (tmp_path / 'sessions' / 'discord_100_channels.json').exists()
+    assert (tmp_path / 'sessions' / 'discord_200_channels.json').exists()
+    assert cache.tg_peers == {1: PEERS[1]}
+    assert (tmp_path / 'sessions' / '1234567890_peers.json').exists()
+
+
+def test_corrupt_discord_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'sessions').mkdir()
+    (tmp_path / 'sessions' / 'discord_100_channels.json').write_text('{"a"')
+    cache = EntityCache()
+    cache.load_discord(100)
+    assert cache.discord_channel_ids == set()
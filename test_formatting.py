@@ -0,0 +1,143 @@
+import time
+from telethon.tl import types
+from formatting import tg_to_discord, discord_to_tg
+
+
+def coverage(text, entities):
+    # Какие непробельные символы (в единицах UTF-16) покрыты каждым типом сущности
+    units = []
+    for char in text:
+        units.extend([char] * (2 if char > '\uffff' else 1))
+    covered = set()
+    for entity in entities:
+        attrs = (type(entity).__name__, getattr(entity, 'url', None), getattr(entity, 'language', None))
+        for unit in range(entity.offset, entity.offset + entity.length):
+            if not units[unit].isspace():
+                covered.add(attrs + (unit,))
+    return covered
+
+
+def roundtrip(text, entities):
+    markdown = tg_to_discord(text, entities)
+    parsed_text, parsed_entities = discord_to_tg(markdown)
+    assert parsed_text == text, markdown
+    assert coverage(parsed_text, parsed_entities) == coverage(text, entities), markdown
+    return markdown
+
+
+def test_plain_entities():
+    text = 'bold italic under strike spoiler code'
+    entities = [
+        types.MessageEntityBold(0, 4), types.MessageEntityItalic(5, 6),
+        types.MessageEntityUnderline(12, 5), types.MessageEntityStrike(18, 6),
+        types.MessageEntitySpoiler(25, 7), types.MessageEntityCode(33, 4),
+    ]
+    assert roundtrip(text, entities) == '**bold** *italic* __under__ ~~strike~~ ||spoiler|| `code`'
+
+
+def test_utf16_offsets():
+    text = '😀 bold 👍🏽 tail'
+    entities = [types.MessageEntityBold(3, 4), types.MessageEntityItalic(8, 4)]
+    assert roundtrip(text, entities) == '😀 **bold** *👍🏽* tail'
+    assert discord_to_tg('😀 **bold**')[1][0].offset == 3
+
+
+def test_escapes():
+    text = 'a*b_c `d` [e] ~~f~~ ||g|| back\\slash snake_case'
+    assert roundtrip(text, []) == 'a\\*b\\_c \\`d\\` \\[e\\] \\~\\~f\\~\\~ \\|\\|g\\|\\| back\\\\slash snake\\_case'
+
+
+def test_line_start_escapes():
+    text = '> not quote\n>>> nor this\n# head\n-# sub\n- item\n+ item\n12. item\n  - nested\nmid > # - 1. ok'
+    markdown = roundtrip(text, [])
+    for line in markdown.split('\n'):
+        assert line.lstrip().startswith(('\\', 'mid')) or line.startswith('12\\.')
+    assert roundtrip('x\n# head', [types.MessageEntityBold(0, 1)]) == '**x**\n\\# head'
+
+
+def test_whitespace_moved_outside_markers():
+    assert roundtrip('ends ', [types.MessageEntityBold(0, 5)]) == '**ends** '
+    assert roundtrip(' pad me ', [types.MessageEntityItalic(0, 8)]) == ' *pad me* '
+    assert roundtrip('a  b', [types.MessageEntityBold(1, 2)]) == 'a  b'
+
+
+def test_overlapping_entities():
+    text = 'overlap here'
+    markdown = roundtrip(text, [types.MessageEntityBold(0, 7), types.MessageEntityItalic(3, 9)])
+    assert '****' not in markdown
+    roundtrip('overlaphere', [types.MessageEntityItalic(0, 7), types.MessageEntityBold(3, 8)])
+    roundtrip('overlaphere', [types.MessageEntityBold(0, 7), types.MessageEntityItalic(3, 8)])
+    roundtrip('abcdef', [types.MessageEntityItalic(0, 3), types.MessageEntityBold(3, 3)])
+    roundtrip('same same', [types.MessageEntityBold(0, 9), types.MessageEntityBold(5, 4)])
+
+
+def best_time(func, argument):
+    timings = []
+    for _ in range(3):
+        started = time.perf_counter()
+        func(argument)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def assert_linear(func, make_input, size):
+    # Вход в 4 раза больше: линейный алгоритм ~4x, квадратичный ~16x. Абсолютное время - в bench_formatting.py
+    assert best_time(func, make_input(size * 4)) < 10 * best_time(func, make_input(size))
+
+
+def test_many_overlapping_entities_stay_linear():
+    chained = lambda n: ('word ' * n, [
+        types.MessageEntityBold(i * 5, 7) if i % 2 else types.MessageEntityItalic(i * 5, 7) for i in range(n - 1)
+    ])
+    crossing = lambda n: ('word ' * n, [
+        types.MessageEntityBold(i, n) if i % 2 else types.MessageEntityItalic(i, n) for i in range(n)
+    ])
+    for make_input in (chained, crossing):
+        assert_linear(lambda args: tg_to_discord(*args), make_input, 2000)
+        assert_linear(lambda markdown: discord_to_tg(markdown), lambda n: tg_to_discord(*make_input(n)), 2000)
+    roundtrip(*chained(8000))
+
+
+def test_unclosed_links_stay_linear():
+    for chunk in ('[a](', '[a](<', '[a](<https://', '[a](('):
+        assert_linear(discord_to_tg, lambda n: chunk * n, 2000)
+    assert discord_to_tg('[a](' * 3) == ('[a](' * 3, [])
+
+
+def test_links_with_parentheses():
+    text = 'link and more'
+    entities = [types.MessageEntityTextUrl(0, 4, 'https://x.y/a_(b)')]
+    assert roundtrip(text, entities) == '[link](<https://x.y/a_(b)>) and more'
+    parsed_text, parsed_entities = discord_to_tg('[t](https://a.b/c_(x)) tail')
+    assert parsed_text == 't tail'
+    assert parsed_entities[0].url == 'https://a.b/c_(x)'
+
+
+def test_pre_inside_blockquote():
+    text = 'quote\ncode\nafter'
+    entities = [
+        types.MessageEntityBlockquote(0, 11),
+        types.MessageEntityPre(6, 4, 'py'),
+    ]
+    markdown = roundtrip(text, entities)
+    assert markdown == '> quote\n> ```py\n> code\n> ```\nafter'
+
+
+def test_code_containing_backticks():
+    assert roundtrip('a`b', [types.MessageEntityCode(0, 3)]) == '``a`b``'
+    assert roundtrip('run `ls` now', [types.MessageEntityCode(4, 4)]) == 'run `` `ls` `` now'
+    assert roundtrip('a``b', [types.MessageEntityCode(0, 4)]) == '``` a``b ```'
+    assert roundtrip(' a ', [types.MessageEntityCode(0, 3)]) == '`  a  `'
+    assert roundtrip('xy\n```', [types.MessageEntityPre(0, 6, '')]) == '````\nxy\n```\n````'
+    roundtrip('echo `date`\n````', [types.MessageEntityPre(0, 16, 'sh')])
+
+
+def test_discord_markdown_roundtrip():
+    for markdown in [
+        '**bold** and *it* and __u__ ~~s~~ ||sp|| `code`',
+        '***both*** [link](<https://ex.com/a_b>) 2 \\* 3 = 6',
+        '```py\nprint(1)\n```\nafter',
+        '> quoted *line*\n> second\nnot quoted',
+    ]:
+        text, entities = discord_to_tg(markdown)
+        assert tg_to_discord(text, entities) == markdown
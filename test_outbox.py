@@ -0,0 +1,177 @@
+import asyncio
+import json
+import os
+from outbox import RouteOutbox, Outbox, DestinationUnavailable
+
+
+class FakeDestination:
+    def __init__(self):
+        self.delivered = []
+        self.down = False
+        self.rejected = set()
+        self.limit = None  # После стольких доставок адресат "падает"
+
+    async def send(self, message):
+        if self.down:
+            raise DestinationUnavailable('down', retry_after=0.01)
+        if message in self.rejected:
+            raise ValueError(f'rejected {message}')
+        self.delivered.append(message)
+        if len(self.delivered) == self.limit:
+            self.down = True
+
+
+async def wait_for(condition, timeout=5):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError('condition not met in time')
+
+
+def segments(spool_dir):
+    return sorted(f for f in os.listdir(spool_dir) if f.endswith('.log'))
+
+
+def test_ordered_delivery_through_memory_spill_and_drain(tmp_path):
+    async def scenario():
+        destination = FakeDestination()
+        destination.down = True
+        route = RouteOutbox('test', destination.send, str(tmp_path), max_memory=5, segment_size=4)
+        route.start()
+        for i in range(30):
+            route.put(i)
+            if i == 2:
+                await asyncio.sleep(0.05)  # Первая неудачная отправка сбрасывает память в головной сегмент
+        assert segments(tmp_path)
+        destination.down = False
+        await wait_for(lambda: len(destination.delivered) == 30)
+        assert destination.delivered == list(range(30))
+        route.put(30)
+        await wait_for(lambda: len(destination.delivered) == 31)
+        route.close()
+        assert segments(tmp_path) == []
+
+    asyncio.run(scenario())
+
+
+def test_close_during_outage_keeps_everything(tmp_path):
+    async def scenario():
+        destination = FakeDestination()
+        destination.down = True
+        route = RouteOutbox('test', destination.send, str(tmp_path), max_memory=5, segment_size=4)
+        route.start()
+        for i in range(3):
+            route.put(i)
+        await asyncio.sleep(0.05)
+        for i in range(3, 20):
+            route.put(i)
+        route.close()
+
+        destination = FakeDestination()
+        route = RouteOutbox('test', destination.send, str(tmp_path), max_memory=5, segment_size=4)
+        route.put(20)
+        route.start()
+        await wait_for(lambda: len(destination.delivered) == 21)
+        assert destination.delivered == list(range(21))
+        route.close()
+
+    asyncio.run(scenario())
+
+
+def test_restart_resumes_from_head_segment_and_cursor(tmp_path):
+    async def scenario():
+        route = RouteOutbox('test', FakeDestination().send, str(tmp_path), max_memory=1, segment_size=10)
+        for i in range(6):
+            route.put(i)
+        route.close()
+        # Сообщение из памяти старше записанных на диск, поэтому его сегмент идёт первым
+        assert segments(tmp_path) == ['-000000001.log', '0000000000.log']
+
+        destination = FakeDestination()
+        destination.limit = 3
+        route = RouteOutbox('test', destination.send, str(tmp_path), max_memory=1, segment_size=10)
+        route.start()
+        await wait_for(lambda: destination.down)
+        route.close()
+        assert destination.delivered == [0, 1, 2]
+
+        destination = FakeDestination()
+        route = RouteOutbox('test', destination.send, str(tmp_path), max_memory=1, segment_size=10)
+        route.start()
+        await wait_for(lambda: len(destination.delivered) == 3)
+        await asyncio.sleep(0.05)
+        assert destination.delivered == [3, 4, 5]
+        route.close()
+
+    asyncio.run(scenario())
+
+
+def test_corrupt_line_is_skipped(tmp_path):
+    with open(tmp_path / '0000000000.log', 'w', encoding='utf-8') as f:
+        f.write(json.dumps('first') + '\n{"broken\n' + json.dumps('second') + '\n')
+    with open(tmp_path / '0000000001.log', 'w', encoding='utf-8') as f:
+        f.write(json.dumps('third') + '\n' + '{"unfinished')
+
+    async def scenario():
+        destination = FakeDestination()
+        route = RouteOutbox('test', destination.send, str(tmp_path))
+        route.start()
+        await wait_for(lambda: len(destination.delivered) == 3)
+        await asyncio.sleep(0.05)
+        assert destination.delivered == ['first', 'second', 'third']
+        assert segments(tmp_path) == []
+        route.close()
+
+    asyncio.run(scenario())
+
+
+def test_rejected_message_goes_to_dead_letters(tmp_path):
+    failures = []
+
+    async def scenario():
+        destination = FakeDestination()
+        destination.rejected.add('bad')
+        route = RouteOutbox('test', destination.send, str(tmp_path),
+                            on_failure=lambda message, error: failures.append(message))
+        route.start()
+        for message in ('before', 'bad', 'after'):
+            route.put(message)
+        await wait_for(lambda: len(destination.delivered) == 2)
+        route.close()
+        assert destination.delivered == ['before', 'after']
+
+    asyncio.run(scenario())
+    assert failures == ['bad']
+    with open(tmp_path / 'dead_letters.jsonl', encoding='utf-8') as f:
+        dead_letters = [json.loads(line) for line in f]
+    assert [entry['message'] for entry in dead_letters] == ['bad']
+    assert dead_letters[0]['error'] == 'rejected bad'
+
+
+def test_blocked_route_does_not_delay_others(tmp_path):
+    async def scenario():
+        telegram, discord = FakeDestination(), FakeDestination()
+        telegram.down = True
+
+        async def send_telegram(route_id, message):
+            await telegram.send((route_id, message))
+
+        async def send_discord(route_id, message):
+            await discord.send((route_id, message))
+
+        outbox = Outbox(str(tmp_path), {'telegram': send_telegram, 'discord': send_discord})
+        outbox.open_account('telegram', '100')
+        outbox.open_account('discord', 200)
+        for i in range(3):
+            outbox.put('telegram', 1, i)
+            outbox.put('discord', 2, i)
+        await wait_for(lambda: len(discord.delivered) == 3)
+        assert discord.delivered == [(2, 0), (2, 1), (2, 2)]
+        assert telegram.delivered == []
+
+        outbox.close_account('telegram', purge=True)
+        assert not os.path.exists(tmp_path / 'telegram_100')
+        outbox.close()
+
+    asyncio.run(scenario())